@@ -1,8 +1,12 @@
 from .utils import is_valid_ip, is_valid_hostname, is_valid_mqtt_topic
 from typing import Final
+from dataclasses import dataclass
+import functools
 import logging
 import os
 import asyncio
+import socket
+import threading
 import paho.mqtt.client as mqtt
 
 
@@ -11,85 +15,207 @@ DEFAULT_MQTT_BROKER: Final[str] = 'localhost'
 DEFAULT_MQTT_PORT: Final[int] = 1883
 DEFAULT_TOPIC_PREFIX: Final[str] = 'smatrix'
 DEFAULT_TOPIC_SUFFIX: Final[str] = 'climate'
-
-
+RECONNECT_DELAY_MIN: Final[int] = 1  # seconds
+RECONNECT_DELAY_MAX: Final[int] = 120  # seconds
+MISC_LOOP_INTERVAL: Final[int] = 1  # seconds, keep-alive handling when driven by the asyncio loop
+SOCKET_SNDBUF_SIZE: Final[int] = 4096  # bytes, payloads are small JSON documents
+# Telemetry is periodic and idempotent: every message supersedes the previous reading of the same
+# topic, so a lost message is harmless. Subscribers needing delivery guarantees should not rely on it.
+MQTT_QOS: Final[int] = 0
+# Unchanged messages are skipped by flush(), but still republished at least this often, so a lost
+# message is superseded and subscribers keep seeing a fresh timestamp
+REPUBLISH_INTERVAL: Final[int] = 300  # seconds
+
+
+@dataclass(frozen=True, slots=True)
 class MqttConfig:
     """MQTT configuration."""
-    def __init__(self, broker: str, port: int, username: str | None, password: str | None, keep_alive: int | None = None) -> None:
-        self.broker = broker
-        self.port = port
-        self.username = username
-        self.password = password
-        self.keep_alive = keep_alive
+    broker: str
+    port: int
+    username: str | None
+    password: str | None
+    keep_alive: int | None = None
 
     def __str__(self) -> str:
         return f"MQTT broker: {self.broker}, port: {self.port}, username: {self.username}, password: {self.password}, keep alive: {self.keep_alive}"
 
 
 class MqttPubClient():
-    """MQTT publisher client."""
+    """MQTT publisher client. Network I/O is driven by the asyncio event loop, no paho thread is used."""
     def __init__(self, config: MqttConfig) -> None:
         self._logger = logging.getLogger(self.__class__.__name__)
-        self._mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION_2)
+        self._mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        self._publish = self._mqttc.publish # Bound once, called for every message in flush()
         if config.username is not None:
             self._mqttc.username_pw_set(config.username, config.password)
         self.connected = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._connect_task: asyncio.Task | None = None
+        self._misc_handle: asyncio.TimerHandle | None = None
+        self._reconnect_handle: asyncio.TimerHandle | None = None
+        self._reconnect_delay = RECONNECT_DELAY_MIN
+        self._closing = False
+        self._pending: dict[str, tuple[str | bytes, object]] = {} # Latest staged (payload, dedupe key) per topic, sent on flush()
+        self._last_sent: dict[str, tuple[object, float]] = {} # (dedupe key, loop time) of the last payload sent per topic
+        self._mqttc.on_connect = self._on_connect
+        self._mqttc.on_disconnect = self._on_disconnect
+        # Register the paho socket with the event loop instead of running loop_start()
+        self._mqttc.on_socket_open = self._on_socket_open
+        self._mqttc.on_socket_close = self._on_socket_close
+        self._mqttc.on_socket_register_write = self._on_socket_register_write
+        self._mqttc.on_socket_unregister_write = self._on_socket_unregister_write
         try: 
             self._mqttc.connect_async(config.broker, config.port, keepalive=config.keep_alive)
-            self._mqttc.loop_start()
         except mqtt.MQTTException as e:
-            self._logger.error(f"Error connecting to MQTT broker: {str(e)}")
-            self._logger.debug(f"Error details: {repr(e)}")
+            self._logger.error("Error connecting to MQTT broker: %s", e)
+            self._logger.debug("Error details: %r", e)
             raise
         except Exception as e:
-            self._logger.error(f"Unexpected exception occurred: {str(e)}")
-            self._logger.debug(f"Error details: {repr(e)}")
+            self._logger.error("Unexpected exception occurred: %s", e)
+            self._logger.debug("Error details: %r", e)
             raise
+        self._connect()
 
-    @self._mqttc.connect_callback()
-    def on_connect(self, client, userdata, flags, rc) -> None:
-        try:
-            if rc == 0:
-                self.connected.set()
-                self._logger.info("Connected to MQTT broker")
-            elif rc == 3: # Server unavailable.
-                self._logger.error(f"Connection refused - server unavailable")
-                self._logger.debug(f"Return code details: {repr(rc)}")
-            else: # Unrecoverable error
-                self._logger.error(f"Connection refused - return code: {str(rc)}")
-                self._logger.debug(f"Return code details: {repr(rc)}")
-                raise mqtt.MQTTException(f"Connection refused - return code: {str(rc)}")
-        except Exception as e:
-            self._logger.error(f"Error in on_connect callback: {str(e)}")
+    def _connect(self) -> None:
+        """Start a connection (or reconnection) attempt to the broker. Failures are retried with back-off."""
+        self._reconnect_handle = None
+        self._connect_task = self._loop.create_task(self._async_connect())
 
+    async def _async_connect(self) -> None:
+        # reconnect() resolves the broker address and opens the TCP connection synchronously (blocking up to
+        # paho's connect timeout), so it runs in the default executor to keep the event loop responsive
+        try:
+            await self._loop.run_in_executor(None, self._mqttc.reconnect)
+        except OSError as e:
+            self._logger.warning("Unable to connect to MQTT broker: %s", e)
+            self._logger.debug("Error details: %r", e)
+            self._schedule_reconnect()
+        finally:
+            self._connect_task = None
+
+    def _schedule_reconnect(self) -> None:
+        """Schedule a reconnection attempt on the event loop, doubling the delay up to RECONNECT_DELAY_MAX."""
+        if self._closing or self._reconnect_handle is not None:
+            return
+        self._logger.info("Reconnecting to MQTT broker in %s seconds...", self._reconnect_delay)
+        self._reconnect_handle = self._loop.call_later(self._reconnect_delay, self._connect)
+        self._reconnect_delay = min(self._reconnect_delay * 2, RECONNECT_DELAY_MAX)
+
+    def _call_in_loop(self, callback, *args) -> None:
+        """Run callback on the event loop thread. paho calls the socket callbacks from reconnect(), which runs in an executor."""
+        if threading.get_ident() == self._loop_thread_id:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
 
-    @self._mqttc.disconnect_callback()
-    def on_disconnect(self, client, userdata, rc) -> None:
+    def _on_socket_open(self, client, userdata, sock) -> None:
+        try:
+            # Send each small publish immediately instead of waiting for Nagle coalescing
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SNDBUF_SIZE)
+        except OSError as e:
+            self._logger.debug("Unable to set socket options: %r", e)
+        self._call_in_loop(self._add_socket, client, sock)
+
+    def _add_socket(self, client, sock) -> None:
+        self._loop.add_reader(sock, client.loop_read)
+        self._misc_handle = self._loop.call_later(MISC_LOOP_INTERVAL, self._loop_misc)
+
+    def _on_socket_close(self, client, userdata, sock) -> None:
+        # Pass the file descriptor, paho closes the socket right after this callback returns
+        self._call_in_loop(self._remove_socket, sock.fileno())
+
+    def _remove_socket(self, fd: int) -> None:
+        self._loop.remove_reader(fd)
+        if self._misc_handle is not None:
+            self._misc_handle.cancel()
+            self._misc_handle = None
+
+    def _on_socket_register_write(self, client, userdata, sock) -> None:
+        self._call_in_loop(self._loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock) -> None:
+        self._call_in_loop(self._loop.remove_writer, sock.fileno())
+
+    def _loop_misc(self) -> None:
+        """Handle keep-alive and timeouts while the socket is open."""
+        if self._mqttc.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            self._misc_handle = self._loop.call_later(MISC_LOOP_INTERVAL, self._loop_misc)
+
+    def _on_connect(self, client, userdata, connect_flags, reason_code, properties) -> None:
+        if reason_code.is_failure:
+            # paho closes the connection after a refused CONNACK, on_disconnect schedules the next attempt
+            self._logger.error("Connection refused - %s", reason_code)
+            self._logger.debug("Reason code details: %r", reason_code)
+            return
+        self._reconnect_delay = RECONNECT_DELAY_MIN
+        # Clean session with non-retained messages: send everything again on the next flush
+        self._last_sent.clear()
+        self.connected.set()
+        self._logger.info("Connected to MQTT broker")
+
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties) -> None:
         self.connected.clear()
-        if rc != 0:
-            self._logger.warning("Unexpected disconnection from MQTT broker. Attempting to reconnect...")
-            self._logger.debug(f"Return code details: {repr(rc)}")
-        else:
+        if self._closing:
             self._logger.info("Disconnected from MQTT broker")
-
-
-    def publish(self, topic: str, message: str) -> None:
-        if self.connected.is_set():
+        else:
+            self._logger.warning("Unexpected disconnection from MQTT broker.")
+            self._logger.debug("Reason code details: %r", reason_code)
+            self._schedule_reconnect()
+
+
+    def publish(self, topic: str, message: str | bytes, key: object = None) -> None:
+        """
+        Stage a message for the next flush(). A newer message for the same topic replaces the staged one.
+        key is what flush() compares to skip unchanged messages, e.g. the payload without its timestamp.
+        It defaults to the message itself.
+        """
+        self._pending[topic] = (message, message if key is None else key)
+
+
+    def flush(self) -> None:
+        """
+        Publish all staged messages back-to-back with QoS 0 (fire and forget, see MQTT_QOS).
+        Messages whose key equals that of the last message sent on the same topic are skipped,
+        unless that message was sent more than REPUBLISH_INTERVAL seconds ago.
+        While disconnected the staged messages are kept until the next flush.
+        """
+        if not self.connected.is_set() or len(self._pending) == 0:
+            return
+        now = self._loop.time()
+        for topic, (message, key) in self._pending.items():
+            last_sent = self._last_sent.get(topic)
+            if last_sent is not None and last_sent[0] == key and now - last_sent[1] < REPUBLISH_INTERVAL:
+                continue
             try:
-                self._mqttc.publish(topic, message)
+                info = self._publish(topic, message, qos=MQTT_QOS)
+                if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                    self._last_sent[topic] = (key, now)
+                else:
+                    self._logger.warning("Unable to publish to %s: %s", topic, mqtt.error_string(info.rc))
             except Exception as e:
-                self._logger.error(f"Unexpected exception occurred: {str(e)}")
-                self._logger.debug(f"Error details: {repr(e)}")
+                self._logger.error("Unexpected exception occurred: %s", e)
+                self._logger.debug("Error details: %r", e)
+        self._pending.clear()
 
 
     def disconnect(self):
+        self._closing = True
+        if self._reconnect_handle is not None:
+            self._reconnect_handle.cancel()
+        if self._connect_task is not None:
+            self._connect_task.cancel()
         self._mqttc.disconnect()
-        self._mqttc.loop_stop()
+        # Flush the DISCONNECT packet now, the event loop may not run again
+        self._mqttc.loop_write()
         self._logger.info("MQTT client disconnected")
 
 
-def get_mqtt_vars() -> MqttConfig | None:
-    """Get environment variables for MQTT client."""
+@functools.lru_cache(maxsize=1)
+def get_mqtt_vars() -> tuple[MqttConfig, str, str | None] | None:
+    """Get environment variables for MQTT client. Evaluated once, later calls return the cached result."""
     logger = logging.getLogger(__name__)
 
     mqtt_broker = os.getenv('MQTT_BROKER', DEFAULT_MQTT_BROKER)
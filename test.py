@@ -1,12 +1,12 @@
 from utils import is_valid_ip, is_valid_hostname
 from uhome_api_wrapper import UponorClient, UponorThermostat
 from mqttclient import MqttConfig, MqttPubClient, get_mqtt_vars
+import dataclasses
 import logging
 import asyncio
 import signal
 import os
 import sys
-import random
 import json
 from typing import Tuple
 from requests import RequestException
@@ -93,7 +93,6 @@ class ThermostatController():
                 await self._trigger.wait()
                 # Skip API calls to Uhome if not connected to MQTT broker
                 if True: #self.mqttc.connected.is_set():
-#                    await asyncio.sleep(random.uniform(0, 1))  # Introduce a random delay to avoid synchronization
                     # Update thermostat
                     try:
                         await self.thermostat.async_update()
@@ -151,9 +150,9 @@ async def main() -> None:
         sys.exit(1)
     else:
         # Make sure the keep-alive interval is longer than the update interval to avoid unncessary pings
-        mqtt_config.keep_alive = update_interval + 5  
+        mqtt_config = dataclasses.replace(mqtt_config, keep_alive=update_interval + 5)
     try: 
-        uhome = UponorClient(uhome_addr)
+        uhome = await UponorClient.create(uhome_addr)
         mqttc = None #MqttPubClient(mqtt_config)
         logger.debug(f"Discovered {len(uhome.thermostats)} thermostats.")
         if len(uhome.thermostats) == 0:
@@ -170,7 +169,7 @@ async def main() -> None:
                     logger.debug(f"Triggered update and publish loop for thermostat {thermostat.identity} / {thermostat.name}.")   
                 try: 
                     # Wait for either the sleep to complete or the event to be set
-                    await asyncio.wait_for(asyncio.create_task(shutdown.wait()), timeout=update_interval)
+                    await asyncio.wait_for(shutdown.wait(), timeout=update_interval)
                 except asyncio.TimeoutError:
                     # Check if each thermostant has completed the update and publish loop
                     for thermostat in thermostats:
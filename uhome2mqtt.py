@@ -1,29 +1,27 @@
 from .utils import is_valid_ip, is_valid_hostname
-from .uhome_api_wrapper import UponorClient, UponorThermostat
+from .uhome_api_wrapper import UponorClient, UponorThermostat, UponorAPIRetryable, UponorAPIFatal
 from .mqttclient import MqttConfig, MqttPubClient, get_mqtt_vars
+import dataclasses
+import functools
 import logging
 import asyncio
 import signal
 import os
 import sys
-import random
-import json
+import orjson
 from typing import Tuple, Final, Optional
 from requests import RequestException
-from datetime import timezone
+from datetime import datetime, timezone
 
 """Constants."""
 MIN_UPDATE_INTERVAL: Final[int] = 15  # seconds
 DEFAULT_UPDATE_INTERVAL: Final[int] = 60  # seconds
+UPDATE_ATTEMPTS: Final[int] = 3  # per update cycle, only U@home server errors are retried
+UPDATE_RETRY_DELAY: Final[float] = 1.0  # seconds, doubled after every failed attempt
 
-key_mapping = {
-    'rh_value': 'humidity',
-    'room_temperature': 'temperature',
-    'room_setpoint': 'tempsetpoint'
-}
-
+@functools.lru_cache(maxsize=1)
 def get_env_vars() -> Tuple[str, int]:
-    """Get environment variables."""
+    """Get environment variables. Evaluated once, later calls return the cached result."""
     logger = logging.getLogger(__name__)
 
     uhome_addr = os.getenv('UHOME_ADDR')
@@ -51,73 +49,61 @@ class ThermostatController():
     """
     Thermostat controller that utilizes Uponor U@Home API to interact with U@Home.
     """
+    __slots__ = ('_logger', 'uponor_client', 'thermostat', '_attr_room', '_key_objs',
+                 'name', 'pub_topic', 'identity', 'mqttc')
+
+    # U@home value name -> key in the published payload
+    _KEY_MAP: Final[tuple[tuple[str, str], ...]] = (
+        ('rh_value', 'humidity'),
+        ('room_temperature', 'temperature'),
+        ('room_setpoint', 'tempsetpoint'),
+        )
+
     def __init__(self, thermostat: UponorThermostat, mqttc: MqttPubClient, mqtt_topic_prefix: str, mqtt_topic_suffix: Optional[str]) -> None:
         self._logger = logging.getLogger(self.__class__.__name__)
         self._logger.setLevel(logging.DEBUG)
         self._logger.debug("Initializing ThermostatController...")
         try:
-            self._available = False
             self.uponor_client = thermostat.uponor_client
             self.thermostat = thermostat
-            self.name = f"{thermostat.by_name('room_name').value.lower().replace(' ', '_')}"
+            # Cache the value objects read on every update; they are updated in place by the API client
+            self._attr_room = thermostat.by_name('room_name')
+            self._key_objs = [(output_key, thermostat.by_name(input_key)) for input_key, output_key in self._KEY_MAP]
+            self.name = f"{self._attr_room.value.lower().replace(' ', '_')}"
             self.pub_topic = f"{mqtt_topic_prefix}/{self.name}/{mqtt_topic_suffix}" if mqtt_topic_suffix else f"{mqtt_topic_prefix}/{self.name}"
             self.identity = f"c{thermostat.controller_index}_t{thermostat.thermostat_index}"
-            self._trigger = asyncio.Event()
             self.mqttc = mqttc
-            self._logger.debug(f"Thermostat {self.identity} / {self.name} initialized with MQTT topic: {self.pub_topic}.")
+            self._logger.debug("Thermostat %s / %s initialized with MQTT topic: %s.", self.identity, self.name, self.pub_topic)
         except Exception as e:
-            self._logger.error(f"Error initializing ThermostatController: {str(e)}")
-            self._logger.debug(f"Error details: {repr(e)}")
+            self._logger.error("Error initializing ThermostatController: %s", e)
+            self._logger.debug("Error details: %r", e)
             raise
 
-    def trigger(self) -> None: 
-        """Trigger the update and publish loop."""
-        self._trigger.set()
-
-
-    def check_completion(self) -> None:
-        """Check if the update and publish loop has completed."""
-        if self._trigger.is_set():
-            self._logger.error(f"Thermostat {self.identity} in {self.name} did not complete the update and publish loop.")
-
-
-    async def update_publish_loop(self) -> None:
-        """Update thermostat data and publish to MQTT."""
-        global key_mapping
-        self._logger.debug(f"Starting control loop for thermostat {self.identity} / {self.name}.")
-        try:
-            while True:
-                await self._trigger.wait()
-                # Skip API calls to Uhome if not connected to MQTT broker
-                if self.mqttc.connected.is_set():
-                    await asyncio.sleep(random.uniform(0, 1))  # Introduce a random delay to avoid synchronization
-                    # Update thermostat
-                    try:
-                        await self.thermostat.async_update()
-                        valid = self.thermostat.is_valid()
-                        self._available = valid
-                        if not valid:
-                            self._logger.info(f"Invalid data for thermostat {self.identity} in {self.name}")
-                    except Exception as e:
-                        self._available = False
-                        self._logger.error(f"Thermostat {self.identity} in {self.name} was unable to update: {e}")
-                    #Prepare MQTT payload 
-                    print(f"{self.thermostat.by_name('room_name').value} - temp: {self.thermostat.by_name('room_temperature').value}°C - humidity: {self.thermostat.by_name('rh_value').value}%")
-                    data = {}
-                    for input_key, output_key in key_mapping.items():
-                        value = self.thermostat.by_name(input_key).value
-                        if value is not None:
-                            data[output_key] = value
-                    data['time'] = self.thermostat.last_update(timezone.utc).isoformat() # Add timestamp in ISO 8601 format
-                    # Publish to MQTT
-                    self._logger.debug(f"Publishing to {self.pub_topic}: {json.dumps(data, indent=2)}")
-                    self.mqttc.publish(self.pub_topic, json.dumbs(data))
-                self._trigger.clear() # Reset the event for the next trigger     
-        except asyncio.CancelledError:
-            self._logger.debug(f"Control loop for thermostat {self.identity} in {self.name} was cancelled.")
-            raise
-        except Exception as e:
-            self._logger.error(f"Unexpected error in control loop for thermostat {self.identity} / {self.name}: {e}")
+    def publish(self, timestamp: str) -> None:
+        """
+        Stage the thermostat data for publishing to MQTT. The data is updated in bulk by UponorClient.async_update_all().
+        timestamp is the ISO 8601 time of that update, formatted once per cycle and shared by all thermostats.
+        Unchanged values are only republished after a reconnect or once the last message is older than
+        mqttclient.REPUBLISH_INTERVAL, so the timestamp of the last received message can lag by up to that long.
+        """
+        if not self.thermostat.is_valid():
+            # Out of range temperature or setpoint, keep the last valid reading instead of publishing it
+            self._logger.info("Invalid data for thermostat %s in %s, not publishing", self.identity, self.name)
+            return
+        #Prepare MQTT payload 
+        values = {}
+        for output_key, attr in self._key_objs:
+            value = attr.value
+            if value is not None:
+                values[output_key] = value
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("%s - temp: %s°C - humidity: %s%%", self._attr_room.value, values.get('temperature'), values.get('humidity'))
+        data = {**values, 'time': timestamp}
+        # Stage for the next flush to MQTT. The values without the timestamp are the dedupe key, so unchanged
+        # readings are skipped until the republish interval expires; the message then carries the current timestamp.
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("Staging for %s: %s", self.pub_topic, data)
+        self.mqttc.publish(self.pub_topic, orjson.dumps(data), key=values) # Serialized straight to bytes for paho
 
 async def main() -> None:
     """Main function."""
@@ -132,10 +118,13 @@ async def main() -> None:
 
     # Signal handler and event to initiate graceful shutdown
     shutdown = asyncio.Event() 
+    tick_handle: Optional[asyncio.TimerHandle] = None
 
     def signal_handler(signum) -> None:
         """Signal handler to initiate graceful shutdown of the program."""
         logger.info(f"Signal {signal.Signals(signum).name} received, initiating graceful shutdown...")
+        if tick_handle is not None:
+            tick_handle.cancel()
         shutdown.set()
 
     # Register the signal handler
@@ -145,49 +134,104 @@ async def main() -> None:
 
     # Get configuration from environment variables
     uhome_addr, update_interval = get_env_vars()
-    mqtt_config, mqtt_topic_prefix, mqtt_topic_suffix = get_mqtt_vars()
-    if mqtt_config is None:
+    mqtt_vars = get_mqtt_vars()
+    if mqtt_vars is None:
         logger.error("Exiting.")
         sys.exit(1)
-    else:
-        # Make sure the keep-alive interval is longer than the update interval to avoid unncessary pings
-        mqtt_config.keep_alive = update_interval + 5  
+    mqtt_config, mqtt_topic_prefix, mqtt_topic_suffix = mqtt_vars
+    # Make sure the keep-alive interval is longer than the update interval to avoid unncessary pings
+    mqtt_config = dataclasses.replace(mqtt_config, keep_alive=update_interval + 5)
+    uhome = None
+    mqttc = None
+    # A single future for the shutdown event, reused by every wait below
+    shutdown_task = asyncio.ensure_future(shutdown.wait())
     try: 
-        uhome = UponorClient(uhome_addr)
+        uhome = await UponorClient.create(uhome_addr)
+        # One long-lived MQTT connection shared by all thermostats for the lifetime of the service
         mqttc = MqttPubClient(mqtt_config)
         logger.debug(f"Discovered {len(uhome.thermostats)} thermostats.")
         if len(uhome.thermostats) == 0:
             logger.error("No thermostats discovered. Exiting.")
             sys.exit(1)
-        thermostats = [ThermostatController(thermostat, mqtt_topic_prefix, mqtt_topic_suffix) for thermostat in uhome.thermostats]
-        async with asyncio.TaskGroup() as tg:
-            tasks = [tg.create_task(thermostat.update_publish_loop()) for thermostat in thermostats]
-            logger.info(f"Starting data collection. Publishing every {update_interval} seconds.")
-            while not shutdown.is_set():
-                logger.debug("Triggering update and publish loop for all thermostats.")
-                for thermostat in thermostats:
-                    thermostat.trigger()
-                    logger.debug(f"Triggered update and publish loop for thermostat {thermostat.identity} / {thermostat.name}.")   
-                try: 
-                    # Wait for either the sleep to complete or the event to be set
-                    await asyncio.wait_for(asyncio.create_task(shutdown.wait()), timeout=update_interval)
-                except asyncio.TimeoutError:
-                    # Check if each thermostant has completed the update and publish loop
-                    for thermostat in thermostats:
-                        thermostat.check_completion()
-                except asyncio.CancelledError:
-                    pass
-            for task in tasks:
-                task.cancel()
+        thermostats = [ThermostatController(thermostat, mqttc, mqtt_topic_prefix, mqtt_topic_suffix) for thermostat in uhome.thermostats]
+        logger.info("Waiting for connection to MQTT broker...")
+        connected_task = asyncio.ensure_future(mqttc.connected.wait())
+        await asyncio.wait({connected_task, shutdown_task}, return_when=asyncio.FIRST_COMPLETED)
+        connected_task.cancel()
+        tick_event = asyncio.Event() # Set by tick(), cleared by poll() once the update cycle has completed
+
+        async def update() -> bool:
+            """Update all thermostats in bulk, retrying U@home server errors with exponential back-off. Returns True on success."""
+            delay = UPDATE_RETRY_DELAY
+            for attempt in range(1, UPDATE_ATTEMPTS + 1):
+                try:
+                    await uhome.async_update_all(uhome.thermostats)
+                    return True
+                except UponorAPIRetryable as e:
+                    if attempt == UPDATE_ATTEMPTS:
+                        logger.error("Thermostats were unable to update after %s attempts: %s", attempt, e)
+                        return False
+                    logger.warning("U@home returned status %s, retrying in %s seconds...", e.status_code, delay)
+                    await asyncio.sleep(delay)
+                    delay *= 2
+                except UponorAPIFatal as e:
+                    logger.error("Thermostats were unable to update, U@home returned status %s. Not retrying.", e.status_code)
+                    return False
+                except Exception as e:
+                    logger.error("Thermostats were unable to update: %s", e)
+                    return False
+
+        async def poll() -> None:
+            """Update all thermostats in bulk on every tick and publish the results in one batch."""
+            while True:
+                await tick_event.wait()
+                # Skip API calls to Uhome if not connected to MQTT broker
+                if mqttc.connected.is_set():
+                    if await update():
+                        timestamp = datetime.now(timezone.utc).isoformat(timespec='seconds')
+                        for thermostat in thermostats:
+                            try:
+                                thermostat.publish(timestamp)
+                            except Exception as e:
+                                logger.error("Unexpected error publishing thermostat %s / %s: %s", thermostat.identity, thermostat.name, e)
+                    mqttc.flush()
+                tick_event.clear()
+
+        next_tick = loop.time() # Deadline of the next update cycle on the loop's monotonic clock
+
+        def tick() -> None:
+            """Start the next update cycle and reschedule on a fixed deadline, so the cadence does not drift."""
+            nonlocal tick_handle, next_tick
+            if tick_event.is_set():
+                logger.error("The previous update cycle did not complete within the update interval.")
+            else:
+                logger.debug("Triggering update of all thermostats.")
+                tick_event.set()
+            # Missed deadlines (e.g. after a system suspend) are skipped rather than fired back-to-back
+            next_tick = max(next_tick + update_interval, loop.time())
+            tick_handle = loop.call_at(next_tick, tick)
+
+        if not shutdown_task.done():
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(poll())
+                logger.info(f"Starting data collection. Publishing every {update_interval} seconds.")
+                tick()
+                await shutdown_task
+                tick_handle.cancel()
+                # Leave the group by cancellation so the TaskGroup cancels poll() (a normal exit would wait for it)
+                raise asyncio.CancelledError
     except asyncio.CancelledError:
         pass
     except Exception:
         logger.error("Exiting.")
         sys.exit(1)
-    # Clean up    
-    if not mqttc is None:
-        mqttc.loop_stop()
-        mqttc.disconnect()
+    finally:
+        # Clean up, also when exiting through sys.exit()
+        shutdown_task.cancel()
+        if not uhome is None:
+            await uhome.aclose()
+        if not mqttc is None:
+            mqttc.disconnect()
     logger.info("Exiting.")
 
 
@@ -1,43 +1,111 @@
 from custom_components.uhomeuponor.uponor_api import UponorClient as BaseUponorClient, UponorThermostat, UponorAPIException
+from custom_components.uhomeuponor.uponor_api.utilities import chunks
+from datetime import datetime
 import json
+import orjson
 import httpx
 import logging
 import asyncio
+from typing import Final
 from requests import RequestException
 
+"""Constants."""
+REQUEST_TIMEOUT: Final[float] = 10.0  # seconds
+KEEPALIVE_EXPIRY: Final[float] = 300.0  # seconds, well above the default update interval
+MAX_CONCURRENT_REQUESTS: Final[int] = 2  # U@home is a small embedded device, keep the number of requests in flight low
+
+
+class UponorAPIStatusError(UponorAPIException):
+    """U@home answered an API call with a non-200 HTTP status."""
+    def __init__(self, status_code: int) -> None:
+        super().__init__(f"Unsuccessful API call, status code {status_code}")
+        self.status_code = status_code
+
+
+class UponorAPIRetryable(UponorAPIStatusError):
+    """Server error (5xx), the same call may succeed if retried."""
+
+
+class UponorAPIFatal(UponorAPIStatusError):
+    """Any other non-200 status, retrying the same call will not help."""
+
 class UponorClient(BaseUponorClient):
     """Wrapper for the UponorClient class to allow for direct calls without Home Assistant"""
     
     def __init__(self, server_address: str) -> None:
         super().__init__(None, server_address)  # Pass None to the parent class for hass
         self._logger = logging.getLogger(self.__class__.__name__)
+        # Caps the requests in flight to U@home across all callers, not just within one bulk update
+        self._api_sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
         self._logger.info(f"UponorClient created with server_address: {server_address}")
+        # Shared HTTP client so connections to U@home are kept alive and reused between calls
+        self._http = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            headers={'Content-Type': 'application/json'},
+            # One pooled connection per request in flight, so concurrent requests never wait for a connection
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENT_REQUESTS,
+                max_keepalive_connections=MAX_CONCURRENT_REQUESTS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+                )
+            )
+
+    @classmethod
+    async def create(cls, server_address: str) -> "UponorClient":
+        """Create a client and complete the initial scan of controllers and thermostats before returning it."""
+        self = cls(server_address)
         try:
-            asyncio.create_task(self.rescan())
+            await self.rescan()
         except (ValueError, RequestException) as e:
-            self._logger.error(f"Error from U@home at initial scan: {e}", exc_info=True)
+            self._logger.error("Error from U@home at initial scan: %s", e, exc_info=True)
+            await self.aclose()
             raise UponorAPIException("Error from U@home at initial scan", e)
         except asyncio.CancelledError:
             self._logger.info("Setup U@home was cancelled.")
+            await self.aclose()
+            raise
+        except Exception:
+            await self.aclose()
             raise
+        return self
 
     async def do_rest_call(self, requestObject):
-        data = json.dumps(requestObject)
-        self._logger.debug(f"Request payload: {json.dumps(requestObject, indent=2)}")
+        data = orjson.dumps(requestObject) # bytes, sent as-is by httpx
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("Request payload: %s", json.dumps(requestObject, indent=2))
 
         response = None
         try:
-            async with httpx.AsyncClient() as client:
-                self._logger.debug(f"POST {self.server_uri}")
-                response = await client.post(self.server_uri, data=data, timeout=10.0)
+            self._logger.debug("POST %s", self.server_uri)
+            async with self._api_sem:
+                response = await self._http.post(self.server_uri, content=data)
         except httpx.RequestError as ex:
-            self._logger.error(f"API call error: {ex}", exc_info=True)
+            self._logger.error("API call error: %s", ex, exc_info=True)
             raise UponorAPIException("API call error", ex)
 
         if response.status_code != 200:
-            self._logger.warning(f"Unsuccessful API call to {self.server_uri}. Status code {response.status_code} received.")
-            raise UponorAPIException("Unsuccessful API call")
+            self._logger.warning("Unsuccessful API call to %s. Status code %s received.", self.server_uri, response.status_code)
+            if response.status_code >= 500:
+                raise UponorAPIRetryable(response.status_code)
+            raise UponorAPIFatal(response.status_code)
 
-        response_data = json.loads(response.text)
-        self._logger.debug(f"Response payload: {json.dumps(response_data, indent=2)}")
+        response_data = orjson.loads(response.content) # Parsed from the raw bytes, no str decode
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("Response payload: %s", json.dumps(response_data, indent=2))
         return response_data
+
+    async def async_update_all(self, thermostats: list[UponorThermostat]) -> None:
+        """
+        Update all given thermostats together. Their values are combined into as few read requests
+        as max_values_batch allows, which are issued concurrently (do_rest_call() caps the requests in flight).
+        """
+        values = [value for thermostat in thermostats for value in thermostat.properties_byid.values()]
+        allvalue_dict = {value.id: value for thermostat in self.thermostats for value in thermostat.properties_byid.values()}
+        await asyncio.gather(*(self.update_values(allvalue_dict, value_list) for value_list in chunks(values, self.max_values_batch)))
+        now = datetime.now()
+        for thermostat in thermostats:
+            thermostat.last_update = now
+
+    async def aclose(self) -> None:
+        """Close the shared HTTP client and its pooled connections."""
+        await self._http.aclose()
@@ -1,7 +1,14 @@
+import functools
 import ipaddress
 import re
 
 
+_FQDN_RE = re.compile(r'^(?=.{1,253}$)((?!-)[A-Za-z0-9-]{1,63}(?<!-)\.)+[A-Za-z]{2,63}$')
+# Control characters are not allowed in MQTT topics
+_TOPIC_INVALID_RE = re.compile(r'[\x00-\x1F\x7F]')
+
+
+@functools.lru_cache(maxsize=256)
 def is_valid_ip(address: str) -> bool:
     """
     Check if a string is a valid IP address.
@@ -13,6 +20,7 @@ def is_valid_ip(address: str) -> bool:
         return False
 
 
+@functools.lru_cache(maxsize=256)
 def is_valid_fqdn(hostname: str) -> bool:
     """
     Check if a string is a valid fully-qualified domain name.
@@ -21,11 +29,9 @@ def is_valid_fqdn(hostname: str) -> bool:
     Returns:
         bool: True if hostname is valid, False otherwise
     """
-    fqdn_regex = (
-        r'^(?=.{1,253}$)((?!-)[A-Za-z0-9-]{1,63}(?<!-)\.)+[A-Za-z]{2,63}$'
-    )
-    return re.match(fqdn_regex, hostname) is not None
+    return _FQDN_RE.match(hostname) is not None
 
+@functools.lru_cache(maxsize=256)
 def is_valid_hostname(hostname: str) -> bool:
     """
     Check if a string is a valid hostname.
@@ -38,6 +44,7 @@ def is_valid_hostname(hostname: str) -> bool:
         return True
     return is_valid_fqdn(hostname)
 
+@functools.lru_cache(maxsize=256)
 def is_valid_mqtt_topic(topic: str) -> bool:
     """Check if a string is a valid MQTT topic."""
     # MQTT topic rules
@@ -46,5 +53,4 @@ def is_valid_mqtt_topic(topic: str) -> bool:
     if '+' in topic or '#' in topic:
         return False
     # Check for invalid characters (optional, based on your specific needs)
-    invalid_chars = re.compile(r'[\x00-\x1F\x7F]')
-    return not invalid_chars.search(topic)
\ No newline at end of file
+    return not _TOPIC_INVALID_RE.search(topic)
\ No newline at end of file